@@ -0,0 +1,35 @@
+"""
+Ahead-of-time compilation of the inner loops in _loops.
+
+setup.py builds these into the pytempo._pytempo_kernels extension
+module when numba is installed, so that the detector doesn't pause
+to compile them the first time it's used. Running this file directly
+builds the extension next to it instead.
+
+This is a build script rather than part of the package: it imports
+_loops as a top-level module (setup.py puts this directory on
+sys.path, just as running the file directly does), so that building
+the kernels doesn't import the rest of pytempo, or JIT-compile them.
+"""
+from numba.pycc import CC
+
+import _loops
+
+cc = CC('_pytempo_kernels')
+
+cc.export(
+    'detect_beats',
+    _loops.DETECT_BEATS_SIGNATURE,
+)(_loops.detect_beats_loop)
+cc.export(
+    'record_beats',
+    _loops.RECORD_BEATS_SIGNATURE,
+)(_loops.record_beats_loop)
+cc.export(
+    'band_tempos',
+    _loops.BAND_TEMPOS_SIGNATURE,
+)(_loops.band_tempos_loop)
+
+
+if __name__ == "__main__":
+    cc.compile()
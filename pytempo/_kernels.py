@@ -0,0 +1,128 @@
+"""
+Inner loops of the tempo detector.
+
+When numba is installed the loop versions in _loops are compiled to
+native code, either ahead of time by setup.py (see _aot.py) or else
+at import time; otherwise the equivalent numpy implementations here
+are used.
+"""
+import numpy
+
+from ._loops import (
+    BAND_TEMPOS_SIGNATURE,
+    DETECT_BEATS_SIGNATURE,
+    GAP_BPMS,
+    RECORD_BEATS_SIGNATURE,
+    band_tempos_loop,
+    detect_beats_loop,
+    record_beats_loop,
+)
+
+# maps the 512 frequency bins onto 16 sub-bands, each summing
+# a run of 32 neighbouring bins
+BAND_MATRIX = numpy.kron(
+    numpy.eye(16, dtype=numpy.float32),
+    numpy.ones(32, dtype=numpy.float32),
+)
+
+
+def _detect_beats_numpy(spectrum, energy_hist, energy_hist_sum, idx, beats):
+    """
+    Compute the 16 sub-band energies of one instant's spectrum (512
+    complex64 bins), swap them into column 'idx' of the float32 energy
+    history ring while keeping the running per-band totals in
+    'energy_hist_sum' up to date, and set each band's entry in 'beats'
+    to whether its energy is 1.3x its trailing average.
+    """
+    n = energy_hist.shape[1]
+
+    # compute square of modulus of each bin
+    # this gives us amplitudes per frequency
+    ampls_per_freq = numpy.square(spectrum.real)
+    ampls_per_freq += numpy.square(spectrum.imag)
+
+    # compute sub-band energies for this 'instant'
+    energies = numpy.dot(BAND_MATRIX, ampls_per_freq)
+
+    # swap this instant in for the oldest one in the running totals
+    energy_hist_sum -= energy_hist[:, idx]
+    energy_hist_sum += energies
+    energy_hist[:, idx] = energies
+
+    # re-total the ring once per lap to flush any rounding error
+    if idx == n - 1:
+        energy_hist.sum(axis=1, out=energy_hist_sum)
+
+    thresholds = (energy_hist_sum * (1.3 / n)).astype(numpy.float32)
+    numpy.greater(energies, thresholds, out=beats)
+
+
+def _record_beats_numpy(beat_ring, idx, beats, gap_counts):
+    """
+    Write one instant's beats (a bool per band) into the mirrored beat
+    ring at 'idx', replacing the oldest instant, and update the per-band
+    counts of beat pairs for each gap length in 19..34 (an int64 array
+    with one row per band and one column per gap length) to match.
+    """
+    n = beat_ring.shape[1] // 2
+
+    # forget the pairs that started at the instant being replaced
+    gap_counts -= (beat_ring[:, idx, numpy.newaxis] &
+                   beat_ring[:, idx + 19:idx + 35])
+
+    beat_ring[:, idx] = beats
+    beat_ring[:, idx + n] = beats
+
+    # count the pairs that end at the new instant (newest at idx + n)
+    gap_counts += (beats[:, numpy.newaxis] &
+                   beat_ring[:, idx + n - 19:idx + n - 35:-1])
+
+
+def _band_tempos_numpy(gap_counts, out):
+    """
+    Derive a tempo for each band from its counts of beat pairs per gap
+    length, writing each band's BPM into 'out' (NaN for bands with no
+    tempo).
+    """
+    # each gap we found is one vote for its gap length, but
+    # discard gap lengths for which we only noticed one interval
+    votes = gap_counts * (gap_counts >= 2)
+
+    # take the BPM of each band's most voted-for gap length
+    out[:] = GAP_BPMS[votes.argmax(axis=1)]
+
+    # ... if there was enough data to analyze, and it's reasonable :-)
+    out[(votes.sum(axis=1) < 2) | (out <= 71) | (out >= 139)] = numpy.nan
+
+
+try:
+    # built ahead of time by setup.py, if numba was installed (see _aot.py)
+    from ._pytempo_kernels import band_tempos, detect_beats, record_beats
+except ImportError:
+    try:
+        from numba import njit
+    except ImportError:
+        njit = None
+
+    if njit is not None:
+        detect_beats = njit(
+            DETECT_BEATS_SIGNATURE,
+            cache=True,
+            fastmath=True,
+            boundscheck=False,
+        )(detect_beats_loop)
+        record_beats = njit(
+            RECORD_BEATS_SIGNATURE,
+            cache=True,
+            boundscheck=False,
+        )(record_beats_loop)
+        # (no fastmath here - it would let LLVM assume there are no NaNs)
+        band_tempos = njit(
+            BAND_TEMPOS_SIGNATURE,
+            cache=True,
+            boundscheck=False,
+        )(band_tempos_loop)
+    else:
+        detect_beats = _detect_beats_numpy
+        record_beats = _record_beats_numpy
+        band_tempos = _band_tempos_numpy
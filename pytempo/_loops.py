@@ -0,0 +1,97 @@
+"""
+Plain loop versions of the tempo detector's inner loops, and the types
+they are compiled for, written for numba to turn into native code.
+
+This module only depends on numpy, so that setup.py can load it to
+compile the loops ahead of time (see _aot.py) without importing the
+rest of pytempo.
+"""
+import numpy
+
+# a gap of 19 is about 136 bpm, and a gap of 35 is about 73 bpm
+# By staying inside these possible bpm values, we avoid
+# issues with BPM doubling/halving (i.e., missing a beat and counting
+# some votes for 60 BPM instead of 120 BPM, skewing our final result
+# downwards)
+# songs outside of this range are rare anyway (at least in pop music)
+
+# the BPM for each of those gap lengths - there are 43 instants per
+# second, so a beat every gap_length instants is 60 * 43 / gap_length
+GAP_BPMS = 60.0 * 43 / numpy.arange(19, 35)
+
+# the types the compiled versions of the loops are specialised for
+DETECT_BEATS_SIGNATURE = (
+    'void(complex64[:], float32[:, ::1], float64[::1], int64, boolean[::1])'
+)
+RECORD_BEATS_SIGNATURE = (
+    'void(boolean[:, ::1], int64, boolean[::1], int64[:, ::1])'
+)
+BAND_TEMPOS_SIGNATURE = 'void(int64[:, ::1], float64[::1])'
+
+
+def detect_beats_loop(spectrum, energy_hist, energy_hist_sum, idx, beats):
+    """
+    Loop version of _kernels._detect_beats_numpy, written for numba to
+    compile into one pass over the spectrum with no temporary arrays.
+    """
+    n_bands, n = energy_hist.shape
+    for band_idx in range(n_bands):
+        energy = numpy.float32(0)
+        for i in range(band_idx * 32, (band_idx + 1) * 32):
+            energy += (spectrum[i].real * spectrum[i].real +
+                       spectrum[i].imag * spectrum[i].imag)
+
+        energy_hist_sum[band_idx] += energy - energy_hist[band_idx, idx]
+        energy_hist[band_idx, idx] = energy
+
+        if idx == n - 1:
+            total = 0.0
+            for j in range(n):
+                total += energy_hist[band_idx, j]
+            energy_hist_sum[band_idx] = total
+
+        threshold = numpy.float32(energy_hist_sum[band_idx] * (1.3 / n))
+        beats[band_idx] = energy > threshold
+
+
+def record_beats_loop(beat_ring, idx, beats, gap_counts):
+    """
+    Loop version of _kernels._record_beats_numpy, written for numba to
+    compile.
+    """
+    n = beat_ring.shape[1] // 2
+    for band_idx in range(beat_ring.shape[0]):
+        row = beat_ring[band_idx]
+        oldest = row[idx]
+        beat = beats[band_idx]
+        row[idx] = beat
+        row[idx + n] = beat
+        for gap_length in range(19, 35):
+            if oldest and row[idx + gap_length]:
+                gap_counts[band_idx, gap_length - 19] -= 1
+            if beat and row[idx + n - gap_length]:
+                gap_counts[band_idx, gap_length - 19] += 1
+
+
+def band_tempos_loop(gap_counts, out):
+    """
+    Loop version of _kernels._band_tempos_numpy, written for numba to
+    compile.
+    """
+    n_bands, n_gaps = gap_counts.shape
+    for band_idx in range(n_bands):
+        total_votes = 0
+        best_votes = 0
+        best_gap_idx = 0
+        for gap_idx in range(n_gaps):
+            count = gap_counts[band_idx, gap_idx]
+            if count >= 2:
+                total_votes += count
+                if count > best_votes:
+                    best_votes = count
+                    best_gap_idx = gap_idx
+
+        bpm = GAP_BPMS[best_gap_idx]
+        if total_votes < 2 or not 71 < bpm < 139:
+            bpm = numpy.nan
+        out[band_idx] = bpm
@@ -1,22 +1,20 @@
-import copy
+from threading import Thread, Event, Condition
+from collections import Counter
+from functools import partial
 
-from threading import Thread, Event
-from collections import deque, defaultdict
-from queue import Queue, Empty
-from cmath import exp, pi
+import numpy
 
+from ._kernels import band_tempos, detect_beats, record_beats
 
-def fft(x):
-    # adapted from here:
-    # https://rosettacode.org/wiki/Fast_Fourier_transform#Python
-    n = len(x)
-    if n <= 1:
-        return x
-    even = fft(x[0::2])
-    odd = fft(x[1::2])
-    t = [exp(-2j * pi * k / n) * odd[k] for k in range(n // 2)]
-    return [even[k] + t[k] for k in range(n // 2)] + \
-           [even[k] - t[k] for k in range(n // 2)]
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None
+
+try:
+    from scipy.fft import rfft as scipy_rfft
+except ImportError:
+    scipy_rfft = None
 
 
 class TempoDetector(object):
@@ -39,21 +37,61 @@ class TempoDetector(object):
 
         You can pass in your own fft implementation
         (such as numpy.fft.fft) if you do not want to use
-        the included pure-Python implementation (this might
-        be beneficial to you for performance reasons).
+        the default real-input FFT (a pyFFTW plan, or
+        scipy.fft.rfft, or numpy.fft.rfft, depending on
+        what is installed). It is called with a float32
+        array of 1024 mono samples, which it may overwrite,
+        and only the first 512 bins of its output (an array
+        or any sequence of complex values) are inspected.
         """
         self._debug = debug
-        self._fft = fft
+        self._buf = numpy.empty(1024, dtype=numpy.float32)
         if fft_impl is not None:
             self._fft = fft_impl
-        self._in_queue = Queue(maxsize=1024)
+        elif pyfftw is not None:
+            # plan once for our fixed-size transform, over an aligned
+            # input array that doubles as our sample buffer
+            self._buf = pyfftw.empty_aligned(1024, dtype='float32')
+            self._fftw_plan = pyfftw.FFTW(
+                self._buf,
+                pyfftw.empty_aligned(513, dtype='complex64'),
+                flags=('FFTW_PATIENT', 'FFTW_DESTROY_INPUT'),
+            )
+            self._fft = self._execute_fftw_plan
+        elif scipy_rfft is not None:
+            self._fft = partial(scipy_rfft, overwrite_x=True)
+        else:
+            self._fft = numpy.fft.rfft
+        # ring buffer of samples waiting to be processed, allocated with
+        # one column per channel when the first sample arrives; the
+        # read/write positions count samples and only ever increase, as
+        # does the count of samples that have been through detection
+        self._in_ring = None
+        self._mix_weights = None
+        self._in_ring_read = 0
+        self._in_ring_write = 0
+        self._in_ring_processed = 0
+        self._in_ring_cond = Condition()
         self._publisher = publisher
-        self._energy_hist_per_freq_band = []
-        for _ in range(32):
-            self._energy_hist_per_freq_band.append(deque(maxlen=43))
-        self._beat_histories = []
-        for _ in range(32):
-            self._beat_histories.append(deque(maxlen=43*7))
+        # ring buffer of the last 43 sub-band energies, one row per band
+        self._energy_hist = numpy.zeros((16, 43), dtype=numpy.float32)
+        self._energy_hist_idx = 0
+        self._energy_hist_len = 0
+        # running per-band total of the ring, kept in float64 so that
+        # the add/subtract updates don't drift between resyncs
+        self._energy_hist_sum = numpy.zeros(16, dtype=numpy.float64)
+        # ring buffer of the trailing ~7 seconds of beat events, one row
+        # per band; every event is written twice, 301 columns apart, so
+        # that the history in time order is always the contiguous window
+        # of 301 columns starting at the write cursor
+        self._beat_ring = numpy.zeros((16, 2 * 43 * 7), dtype=bool)
+        self._beat_ring_idx = 0
+        self._beat_history_len = 0
+        self._beats = numpy.zeros(16, dtype=bool)
+        # per-band counts of beat pairs in the history for each gap
+        # length (19..34), kept up to date as each instant arrives
+        self._gap_counts = numpy.zeros((16, 16), dtype=numpy.int64)
+        self._band_bpms = numpy.empty(16, dtype=numpy.float64)
         self._processing_thread = Thread(
             target=self._run_data_processing,
             daemon=True,
@@ -61,202 +99,266 @@ class TempoDetector(object):
         self._exit_flag = Event()
         self._processing_thread.start()
 
-    def _gap_to_bpm(self, gap_length):
+    def _execute_fftw_plan(self, samples):
         """
-        Convert a 'gap length' of sequential instantaneous energy
-        bins to a BPM value.
+        Run the pyFFTW plan made in __init__. Its input array is our
+        sample buffer, so 'samples' (always that buffer) is already in
+        place and execute() skips the array checks of calling the plan.
         """
-        return (1 / (gap_length / 43)) * 60.0
+        self._fftw_plan.execute()
+        return self._fftw_plan.output_array
 
-    def _detect_tempo(self, beat_history):
+    def _detect_tempos(self):
         """
-        Look at the beat history and derive a tempo, returning
-        a BPM as an int if one is found (None otherwise).
+        Inspect the bottom 16 frequency band histories, deriving a bpm
+        estimate from each, and then use those 16 samples to select an
+        overall BPM
         """
 
         # wait for a full history before inspecting it
-        if not len(beat_history) == 43*7:
-            return
-
-        # a gap of 19 is about 136 bpm, and a gap of 35 is about 73 bpm
-        # By staying inside these possible bpm values, we avoid
-        # issues with BPM doubling/halving (i.e., missing a beat and counting
-        # some votes for 60 BPM instead of 120 BPM, skewing our final result
-        # downwards)
-        # songs outside of this range are rare anyway (at least in pop music)
-
-        # count all relevant gaps
-        gap_length_counts = defaultdict(lambda: 0)
-        for gap_length in range(19, 35):
-            for start in range(0, len(beat_history) - gap_length):
-                end = start + gap_length
-                if beat_history[start] is True and beat_history[end] is True:
-                    gap_length_counts[gap_length] += 1
-
-        # convert each gap we found into a BPM value (one vote per gap)
-        bpm_candidates = []
-        for gap_length in gap_length_counts.keys():
-
-            # discard BPM candidates for which we only noticed one interval
-            if gap_length_counts[gap_length] < 2:
-                continue
-
-            for _ in range(gap_length_counts[gap_length]):
-                bpm_candidates.append(self._gap_to_bpm(gap_length))
-
-        # if there's not enough data to analyze just give up
-        if len(bpm_candidates) < 2:
+        if self._beat_history_len < 43 * 7:
             return None
 
-        # return the most common BPM
-        counts = defaultdict(lambda: 0)
-        for bpm in bpm_candidates:
-            counts[bpm] += 1
-        counts = [(key, counts[key]) for key in counts.keys()]
-        counts.sort(key=lambda x: x[1], reverse=True)
-        bpm = counts[0][0]
-
-        # ... if it's reasonable :-)
-        if 71 < bpm < 139:
-            return bpm
-        return None
-
-    def _detect_tempos(self):
-        """
-        Inspect the bottom 16 frequency band deques, deriving a bpm estimate
-        from each, and then use those 16 samples to select an overall BPM
-        """
+        if self._debug:
+            beat_history = self._beat_ring[
+                :,
+                self._beat_ring_idx:self._beat_ring_idx + 43 * 7,
+            ]
 
-        if self._debug and len(self._beat_histories[0]) == 43 * 7:
             # dump out the beat histories across
-            # all 32 channels for visual inspection
+            # all 16 channels for visual inspection
             for band_idx in range(16):
                 my_str = ''
-                for e in self._beat_histories[band_idx]:
+                for e in beat_history[band_idx]:
                     my_str += '1' if e else '0'
                 print(my_str)
             print('\n\n')
 
-        # calculate the BPM within each frequency band
-        band_bpms = []
-        for freq_band_idx in range(16):
-            history = list(copy.deepcopy(self._beat_histories[freq_band_idx]))
-            band_bpms.append(self._detect_tempo(history))
+        # calculate the BPM within each frequency band (NaN where
+        # a band has no tempo)
+        band_bpms = self._band_bpms
+        band_tempos(self._gap_counts, band_bpms)
 
         # filter out no-signal bands
-        band_bpms = [bpm for bpm in band_bpms if bpm is not None]
+        band_bpms = band_bpms[~numpy.isnan(band_bpms)].tolist()
         if len(band_bpms) == 0:
             return None
 
-        # count frequency of selected BPMs across bands
-        counts = defaultdict(lambda: 0)
-        for bpm in band_bpms:
-            counts[bpm] += 1
-        counts = [(key, counts[key]) for key in counts.keys()]
-        counts.sort(key=lambda x: x[1], reverse=True)
-
         # return the most commonly detected BPM across the frequency bands
-        return counts[0][0]
+        return Counter(band_bpms).most_common(1)[0][0]
 
-    def _detect_beat(self, data):
+    def _detect_beat(self):
         """
-        Process the raw data to detect beats in this instant, and update
-        history accordingly with a True or False value.
+        Process the buffered samples to detect beats in this instant, and
+        update history accordingly with a True or False value.
         """
-        # collapse data into one channel
-        data = [sum(d) / len(d) for d in data]
-
-        # compute fft of samples (giving us 1024 complex numbers)
-        data = self._fft(data)
-
-        # compute square of modulus of each sample
-        # this gives us amplitudes per frequency
-        ampls_per_freq = [d.real*d.real + d.imag*d.imag for d in data]
-
-        # compute sub-band energies for this 'instant'
-        inst_sub_band_energies = []
-        for sub_band in range(32):
-            sub_band_energy = 0
-            for i in range(32):
-                sub_band_energy += ampls_per_freq[sub_band*32 + i]
-            # store the summed inst energy in this sub-band
-            inst_sub_band_energies.append(sub_band_energy)
-
-        # update sub-band energy histories to include this instant
-        for i in range(len(inst_sub_band_energies)):
-            self._energy_hist_per_freq_band[i].append(
-                inst_sub_band_energies[i]
+        # compute fft of samples - the input is real, so the first
+        # 512 bins cover the whole spectrum (the rest mirror them)
+        # (and stay in single precision, even if a custom fft_impl
+        # hands back complex128, or a plain list)
+        data = numpy.asarray(self._fft(self._buf))[:512]
+        data = data.astype(numpy.complex64, copy=False)
+
+        # compute sub-band energies for this 'instant', update sub-band
+        # energy histories to include it, and compare each band to its
+        # trailing history - a beat is an instant with 1.3x the average
+        # historical energy in the last second
+        detect_beats(
+            data,
+            self._energy_hist,
+            self._energy_hist_sum,
+            self._energy_hist_idx,
+            self._beats,
+        )
+        self._energy_hist_idx = (self._energy_hist_idx + 1) % 43
+        self._energy_hist_len = min(self._energy_hist_len + 1, 43)
+
+        # if we had a complete sub-band energy history to compare
+        # against, record beats found across the 16 lower bands,
+        # sliding the gap counts along with the history
+        if self._energy_hist_len == 43:
+            record_beats(
+                self._beat_ring,
+                self._beat_ring_idx,
+                self._beats,
+                self._gap_counts,
             )
+            self._beat_ring_idx = (self._beat_ring_idx + 1) % (43 * 7)
+            self._beat_history_len = min(self._beat_history_len + 1, 43 * 7)
 
-        # if we have a complete sub-band energy history, compare
-        # the values for this 'instant' to the trailing history
-        if len(self._energy_hist_per_freq_band[0]) == 43:
-
-            # compute the average historical energy in the last
-            # second, per frequency band
-            avg_sub_band_energies = [
-                sum(x) / 43 for x in self._energy_hist_per_freq_band
-            ]
+    def _queued_samples(self):
+        """
+        Number of samples added but not yet taken for processing
+        (callers must hold the input ring's lock).
+        """
+        return self._in_ring_write - self._in_ring_read
 
-            # record beats found across the 16 lower bands
-            for band_idx in range(16):
-                inst_nrg = inst_sub_band_energies[band_idx]
-                avg_nrg = avg_sub_band_energies[band_idx]
-                beat_found = False
-                if inst_nrg > avg_nrg * 1.3:
-                    beat_found = True
-                self._beat_histories[band_idx].append(beat_found)
+    def _wait_for_in_ring_space(self, channels):
+        """
+        Block until the input ring has room for another sample,
+        allocating it first if this is the first sample we've seen
+        (callers must hold the input ring's lock). Raises RuntimeError
+        if the ring is full and the processing thread has stopped, as
+        it would then never have room.
+        """
+        if self._in_ring is None:
+            self._in_ring = numpy.zeros(
+                (4096, channels),
+                dtype=numpy.float32,
+            )
+            # averaging the channels as a matrix-vector product is far
+            # cheaper than mean(axis=1) over such short rows
+            self._mix_weights = numpy.full(
+                channels,
+                1.0 / channels,
+                dtype=numpy.float32,
+            )
+        self._in_ring_cond.wait_for(
+            lambda: (self._exit_flag.is_set() or
+                     self._queued_samples() < len(self._in_ring)),
+        )
+        if self._queued_samples() == len(self._in_ring):
+            raise RuntimeError('TempoDetector has stopped processing')
 
     def _run_data_processing(self):
         """
         Threading target to continually read inputted data
-        and process it in 1024-sample batches.
+        and process it in 1024-sample batches, until shut down
+        (or until processing fails).
         """
-        data = [0] * 1024
-        idx = 0
-
         if self._debug:
             import time
             count = 0
             start_ts = time.time()
 
-        while not self._exit_flag.is_set():
-
-            try:
-                data[idx] = self._in_queue.get(timeout=1)
-            except Empty:
-                continue
-
-            if self._debug:
-                count += 1
-
-            if idx == 1023:
-                self._detect_beat(data)
+        try:
+            while not self._exit_flag.is_set():
+
+                # wait for a full batch, then collapse it into one channel
+                # as we copy it out of the ring (batches start at multiples
+                # of 1024, so never wrap)
+                with self._in_ring_cond:
+                    if not self._in_ring_cond.wait_for(
+                            lambda: self._queued_samples() >= 1024,
+                            timeout=1):
+                        continue
+                    start = self._in_ring_read % len(self._in_ring)
+                    numpy.dot(
+                        self._in_ring[start:start + 1024],
+                        self._mix_weights,
+                        out=self._buf,
+                    )
+                    self._in_ring_read += 1024
+                    self._in_ring_cond.notify_all()
+
+                self._detect_beat()
                 bpm = self._detect_tempos()
                 self._publisher.publish(bpm)
-                idx = 0
-            else:
-                idx += 1
 
-            if self._debug and count % 44100 == 0:
-                print('processed {} seconds of data in '
-                      '{} seconds'
-                      .format(count / 44100,
-                              time.time() - start_ts))
+                # let anyone in wait() know this batch has been published
+                with self._in_ring_cond:
+                    self._in_ring_processed += 1024
+                    self._in_ring_cond.notify_all()
+
+                if self._debug:
+                    count += 1024
+
+                if self._debug and count % (1024 * 43) == 0:
+                    print('processed {} seconds of data in '
+                          '{} seconds'
+                          .format(count / 44100,
+                                  time.time() - start_ts))
+        finally:
+            # stop for good, even if processing failed, and wake anyone
+            # waiting on us so that they don't wait forever
+            with self._in_ring_cond:
+                self._exit_flag.set()
+                self._in_ring_cond.notify_all()
 
     def add_sample(self, sample):
         """
         Push an audio sample into the Detector's internal
-        processing queue.
+        processing queue, blocking while the queue is full
+        (or raising RuntimeError if it is full and will stay
+        that way, because processing has stopped).
 
         Sample should be an iterable of one or more values,
         where each value is the sample value for a single
-        audio channel.
+        audio channel (a lone number is taken as a mono sample).
+        Every sample must have the same number of channels.
         """
-        self._in_queue.put(sample)
+        with self._in_ring_cond:
+            self._wait_for_in_ring_space(numpy.size(sample))
+            self._in_ring[self._in_ring_write % len(self._in_ring)] = sample
+            self._in_ring_write += 1
+
+            # wake the processing thread once a full batch is ready
+            if self._queued_samples() == 1024:
+                self._in_ring_cond.notify_all()
+
+    def add_samples(self, samples):
+        """
+        Push a block of audio samples into the Detector's internal
+        processing queue, blocking while the queue is full (or raising
+        RuntimeError, like add_sample, once processing has stopped).
+        This is much cheaper than calling add_sample once per sample.
+
+        Samples should be an array with one row per sample and one
+        column per audio channel (a 1-D array is taken as mono
+        samples, and a lone number as one mono sample), e.g. the
+        data returned by scipy.io.wavfile.read.
+        """
+        samples = numpy.atleast_1d(samples)
+        if samples.ndim == 1:
+            samples = samples[:, numpy.newaxis]
+        elif samples.ndim != 2:
+            raise ValueError(
+                'samples must be 1-D (mono) or 2-D (one column per '
+                'channel), not {}-D'.format(samples.ndim)
+            )
+
+        pos = 0
+        while pos < len(samples):
+            with self._in_ring_cond:
+                self._wait_for_in_ring_space(samples.shape[1])
+
+                # copy in as much as fits before the ring fills or wraps
+                queued = self._queued_samples()
+                start = self._in_ring_write % len(self._in_ring)
+                count = min(
+                    len(samples) - pos,
+                    len(self._in_ring) - queued,
+                    len(self._in_ring) - start,
+                )
+                self._in_ring[start:start + count] = samples[pos:pos + count]
+                self._in_ring_write += count
+
+                # wake the processing thread once a full batch is ready
+                if queued < 1024 <= queued + count:
+                    self._in_ring_cond.notify_all()
+
+            pos += count
+
+    def wait(self):
+        """
+        Block until every complete 1024-sample batch added so far
+        has been processed and its BPM estimate published (any
+        leftover partial batch waits for more samples), or until
+        the processing thread stops - because the detector was
+        shut down, or because processing failed (e.g. the fft_impl
+        or publisher raised).
+        """
+        with self._in_ring_cond:
+            self._in_ring_cond.wait_for(
+                lambda: (self._exit_flag.is_set() or
+                         self._in_ring_write -
+                         self._in_ring_processed < 1024),
+            )
 
     def shutdown(self):
         """
         Shut down the internal processing thread.
         """
-        self._exit_flag.set()
+        with self._in_ring_cond:
+            self._exit_flag.set()
+            self._in_ring_cond.notify_all()
@@ -1,7 +1,6 @@
 import argparse
 
 import scipy.io.wavfile
-import numpy
 
 from pytempo import TempoDetector
 from pytempo import PrintPublisher
@@ -24,12 +23,12 @@ def main(args):
         raise Exception('Wav file must be 44100Hz')
     detector = TempoDetector(
         PrintPublisher(),
-        fft_impl=numpy.fft.fft,  # inject a non-pure FFT (it's faster)
     )
-    for sample in data:
-        detector.add_sample(
-            sample,
-        )
+    detector.add_samples(
+        data,
+    )
+    detector.wait()
+    detector.shutdown()
 
 
 if __name__ == "__main__":
@@ -3,4 +3,7 @@
 set -eu
 
 flake8 pytempo/*py
-nosetests --with-coverage --cover-package=pytempo
+
+# the integration tests are independent and CPU-bound, so spread them
+# across one worker process per core
+pytest -n auto --cov=pytempo test/
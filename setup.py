@@ -1,14 +1,41 @@
-from distutils.core import setup
+import importlib.util
+import os
+import sys
+
+from setuptools import setup
+
+if importlib.util.find_spec('numba') is not None:
+    # compile the numba kernels into an extension module at build time
+    # (importing the build script on its own, rather than through the
+    # package, so nothing else in pytempo is imported or JIT-compiled)
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'pytempo'))
+    from _aot import cc
+    del sys.path[0]
+
+    # (named after the module that made it, which was top-level here)
+    ext = cc.distutils_extension()
+    ext.name = 'pytempo.' + cc.name
+    ext_modules = [ext]
+else:
+    # (they'll be compiled on first use instead, if numba turns up)
+    ext_modules = []
 
 test_deps = [
     'numpy',
     'flake8',
     'scipy',
     'coverage',
+    'numba',
+    'pytest',
+    'pytest-cov',
+    'pytest-xdist',
 ]
 
 extras={
     'test': test_deps,
+    'numba': ['numba'],
+    'scipy': ['scipy'],
+    'pyfftw': ['pyfftw'],
 }
 
 setup(
@@ -22,6 +49,10 @@ setup(
     packages=[
         'pytempo',
     ],
+    install_requires=[
+        'numpy',
+    ],
+    ext_modules=ext_modules,
     tests_require=test_deps,
     extras_require=extras,
 )
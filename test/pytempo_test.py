@@ -1,10 +1,162 @@
 import os
 import unittest
+from unittest import mock
 
 import numpy
 import scipy.io.wavfile
 
+from pytempo import PrintPublisher
 from pytempo import TempoDetector
+from pytempo import _kernels
+
+
+class PyTempoGapCountTest(unittest.TestCase):
+    # the gap counts are slid along incrementally with the beat history,
+    # so check them against a from-scratch count of its current window
+
+    @unittest.skipIf(
+        _kernels.record_beats is _kernels._record_beats_numpy,
+        'numba is not installed, so there is no compiled version to test',
+    )
+    def test_record_beats(self):
+        self.validate(_kernels.record_beats)
+
+    def test_record_beats_numpy(self):
+        self.validate(_kernels._record_beats_numpy)
+
+    def validate(self, record_beats):
+        rng = numpy.random.RandomState(0)
+        beat_ring = numpy.zeros((16, 2 * 301), dtype=bool)
+        gap_counts = numpy.zeros((16, 16), dtype=numpy.int64)
+        idx = 0
+        for _ in range(1000):
+            record_beats(beat_ring, idx, rng.rand(16) < 0.3, gap_counts)
+            idx = (idx + 1) % 301
+
+        beat_history = beat_ring[:, idx:idx + 301]
+        for band_idx in range(16):
+            for gap_length in range(19, 35):
+                self.assertEqual(
+                    gap_counts[band_idx, gap_length - 19],
+                    numpy.count_nonzero(
+                        beat_history[band_idx, :-gap_length] &
+                        beat_history[band_idx, gap_length:]
+                    ),
+                )
+
+
+class PyTempoBeatDetectionTest(unittest.TestCase):
+    # the compiled beat detection kernel fuses the whole energy pipeline
+    # into one loop, so check it against the numpy version step by step
+
+    @unittest.skipIf(
+        _kernels.detect_beats is _kernels._detect_beats_numpy,
+        'numba is not installed, so there is no compiled version to test',
+    )
+    def test_detect_beats(self):
+        rng = numpy.random.RandomState(0)
+        energy_hists = [numpy.zeros((16, 43), dtype=numpy.float32)
+                        for _ in range(2)]
+        energy_hist_sums = [numpy.zeros(16) for _ in range(2)]
+        beats = [numpy.zeros(16, dtype=bool) for _ in range(2)]
+        for i in range(100):
+            spectrum = numpy.fft.rfft(
+                rng.randint(-2**15, 2**15, 1024).astype(numpy.float32),
+            )[:512].astype(numpy.complex64)
+            for detect_beats, energy_hist, energy_hist_sum, out in zip(
+                    (_kernels.detect_beats, _kernels._detect_beats_numpy),
+                    energy_hists, energy_hist_sums, beats):
+                detect_beats(spectrum, energy_hist, energy_hist_sum,
+                             i % 43, out)
+
+            numpy.testing.assert_allclose(*energy_hists, rtol=1e-5)
+            numpy.testing.assert_allclose(*energy_hist_sums, rtol=1e-5)
+            numpy.testing.assert_array_equal(*beats)
+
+
+class PyTempoPrecisionTest(unittest.TestCase):
+    # the energy pipeline is meant to stay in single precision - these
+    # catch anything silently upcasting it to float64
+
+    def test_default_fft(self):
+        self.validate(None)
+
+    def test_complex128_fft(self):
+        # (numpy 2's fft keeps float32 input in single precision, so
+        # widen it first to be sure of getting complex128 back)
+        self.validate(lambda samples: numpy.fft.fft(samples.astype(float)))
+
+    def test_list_fft(self):
+        self.validate(lambda samples: list(numpy.fft.fft(samples)))
+
+    def validate(self, fft_impl):
+        detector = TempoDetector(
+            PrintPublisher(),
+            fft_impl=fft_impl,
+        )
+        detector.shutdown()
+
+        # record what actually reaches the beat detection kernel (the
+        # numpy fallback would quietly accept a complex128 spectrum)
+        spectrum_dtypes = set()
+
+        def detect_beats(spectrum, *args):
+            spectrum_dtypes.add(spectrum.dtype)
+            _kernels.detect_beats(spectrum, *args)
+
+        # drive the beat detection directly, with no samples queued
+        # for the (now stopping) processing thread
+        rng = numpy.random.RandomState(0)
+        with mock.patch('pytempo.detector.detect_beats', detect_beats):
+            for _ in range(44):
+                detector._buf[:] = rng.randint(-2**15, 2**15, 1024)
+                detector._detect_beat()
+
+        self.assertEqual(spectrum_dtypes, {numpy.dtype(numpy.complex64)})
+        for array in (detector._buf, detector._energy_hist):
+            self.assertEqual(array.dtype, numpy.float32)
+        self.assertEqual(detector._beat_history_len, 2)
+
+
+class PyTempoAddSamplesTest(unittest.TestCase):
+    # add_samples takes the same shapes of input as add_sample does
+
+    def setUp(self):
+        self.detector = TempoDetector(
+            PrintPublisher(),
+        )
+        self.detector.shutdown()
+
+    def test_lone_sample(self):
+        self.detector.add_samples(numpy.int16(5))
+        self.assertEqual(self.detector._in_ring_write, 1)
+        self.assertEqual(self.detector._in_ring.shape[1], 1)
+
+    def test_bad_shape(self):
+        with self.assertRaises(ValueError):
+            self.detector.add_samples(numpy.zeros((4, 2, 2)))
+
+
+class PyTempoFailureTest(unittest.TestCase):
+    # if processing fails, callers should find out rather than hang
+
+    def test_failing_publisher(self):
+        class Pub(object):
+            def publish(self, a):
+                raise ValueError('publisher failed')
+
+        detector = TempoDetector(
+            Pub(),
+        )
+        with self.assertRaises(RuntimeError):
+            detector.add_samples(
+                numpy.zeros(44100, dtype=numpy.int16),
+            )
+        detector.wait()
+
+        # (the thread may still be unwinding when wait() returns)
+        detector._processing_thread.join(5)
+        self.assertFalse(detector._processing_thread.is_alive())
 
 
 class PyTempoIntegrationTest(unittest.TestCase):
@@ -67,15 +219,15 @@ class PyTempoIntegrationTest(unittest.TestCase):
         ))
         detector = TempoDetector(
             Pub(),
-            fft_impl=numpy.fft.fft,
         )
         _, data = scipy.io.wavfile.read(
             wav_file_path,
         )
-        for sample in data:
-            detector.add_sample(
-                sample,
-            )
+        detector.add_samples(
+            data,
+        )
+        detector.wait()
+        detector.shutdown()
         if expected_bpm is None:
             self.assertTrue(len(results) == 0)
         else: